@@ -0,0 +1,237 @@
+import argparse
+import csv
+import io
+import json
+import os
+import zipfile
+from contextlib import closing
+from datetime import date, datetime, timedelta
+
+from invoice_index import connect, index_archive
+
+# How far an invoice date may be from the transaction date and still match
+MATCH_WINDOW_DAYS = 7
+
+# Already-compressed artifacts are stored as-is, recompressing them only costs time
+STORED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.zip'}
+
+LEDGER_FIELDS = [
+    'status', 'transaction_date', 'description', 'amount', 'currency',
+    'invoice_vendor', 'invoice_date', 'invoice_saved_at', 'invoice_amount', 'invoice_path',
+]
+
+# Column names used by Revolut Business statement exports (first match wins)
+DATE_COLUMNS = ['Date completed (UTC)', 'Date started (UTC)', 'Completed Date', 'Started Date', 'Date']
+DESCRIPTION_COLUMNS = ['Description', 'Payee', 'Reference']
+AMOUNT_COLUMNS = ['Amount', 'Total amount', 'Paid out']
+CURRENCY_COLUMNS = ['Payment currency', 'Currency', 'Orig currency']
+STATE_COLUMNS = ['State']
+
+# Only settled payments need an invoice (declined, reverted and failed ones never left the account)
+COMPLETED_STATES = {'COMPLETED'}
+
+
+def pick(row: dict, columns: list[str]) -> str:
+    """First non-empty value among the candidate columns"""
+    for column in columns:
+        if row.get(column):
+            return row[column].strip()
+    return ''
+
+
+def parse_date(value: str) -> date | None:
+    """Parse the date part of a Revolut or index timestamp"""
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def read_transactions(path: str, date_from: date, date_to: date):
+    """Stream completed outgoing transactions in the period from a Revolut CSV statement"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            state = pick(row, STATE_COLUMNS).upper()
+            if state and state not in COMPLETED_STATES:
+                continue
+            when = parse_date(pick(row, DATE_COLUMNS))
+            try:
+                amount = float(pick(row, AMOUNT_COLUMNS).replace(',', ''))
+            except ValueError:
+                continue
+            if when is None or amount >= 0 or not date_from <= when <= date_to:
+                continue
+            yield {
+                'date': when,
+                'description': pick(row, DESCRIPTION_COLUMNS),
+                'amount': -amount,
+                'currency': pick(row, CURRENCY_COLUMNS),
+            }
+
+
+def load_invoices(date_from: date, date_to: date) -> list[dict]:
+    """Index metadata for every dated artifact in the period (paths only, no file contents)"""
+    window = timedelta(days=MATCH_WINDOW_DAYS)
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT path, vendor, kind, invoice_date, saved_at, amount, currency FROM invoices "
+            "WHERE invoice_date BETWEEN ? AND ? ORDER BY invoice_date",
+            ((date_from - window).isoformat(), (date_to + window).isoformat()),
+        )
+        return [dict(row) for row in rows]
+
+
+def load_undated_invoices(date_from: date, date_to: date):
+    """Stream artifacts downloaded in the period that have no invoice date
+
+    The download date says nothing about the billing period, so these are never matched,
+    only listed for review.
+    """
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT path, vendor, kind, invoice_date, saved_at, amount, currency FROM invoices "
+            "WHERE invoice_date IS NULL AND substr(saved_at, 1, 10) BETWEEN ? AND ? ORDER BY saved_at",
+            (date_from.isoformat(), date_to.isoformat()),
+        )
+        for row in rows:
+            if os.path.exists(row['path']):
+                yield dict(row)
+
+
+def match_invoice(transaction: dict, invoices: list[dict], used: set[str]) -> dict | None:
+    """Best unused invoice for a transaction: same amount and currency, close date, vendor named in the description"""
+    description = transaction['description'].lower()
+    best, best_score = None, 0
+
+    for invoice in invoices:
+        if invoice['path'] in used:
+            continue
+        when = parse_date(invoice['invoice_date'])
+        if when is None or abs((when - transaction['date']).days) > MATCH_WINDOW_DAYS:
+            continue
+
+        vendor_match = invoice['vendor'].replace('_', ' ').lower() in description
+        if invoice['amount'] is not None:
+            if abs(invoice['amount'] - transaction['amount']) >= 0.005:
+                continue
+            # The same figure in another currency is a different charge
+            if invoice['currency'] and transaction['currency'] and invoice['currency'].upper() != transaction['currency'].upper():
+                continue
+            score = 3 if vendor_match else 2
+        elif vendor_match:
+            score = 1
+        else:
+            continue
+
+        if score > best_score:
+            best, best_score = invoice, score
+
+    return best
+
+
+def ledger_row(status: str, transaction: dict | None, invoice: dict | None) -> dict:
+    """Flatten a transaction/invoice pair into a ledger row"""
+    transaction = transaction or {}
+    invoice = invoice or {}
+    return {
+        'status': status,
+        'transaction_date': transaction.get('date', ''),
+        'description': transaction.get('description', ''),
+        'amount': f"{transaction['amount']:.2f}" if transaction else '',
+        'currency': transaction.get('currency', ''),
+        'invoice_vendor': invoice.get('vendor', ''),
+        'invoice_date': invoice.get('invoice_date') or '',
+        'invoice_saved_at': invoice.get('saved_at', ''),
+        'invoice_amount': invoice['amount'] if invoice.get('amount') is not None else '',
+        'invoice_path': invoice.get('path', ''),
+    }
+
+
+def add_file(bundle: zipfile.ZipFile, path: str, folder: str) -> None:
+    """Stream an archived file into the bundle, storing already-compressed formats as-is"""
+    extension = os.path.splitext(path)[1].lower()
+    compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    bundle.write(path, arcname=f"{folder}/{os.path.basename(path)}", compress_type=compress_type)
+
+
+def export_bundle(transactions_path: str, date_from: date, date_to: date, output_path: str) -> dict:
+    """Write a ZIP with the period's invoices and a ledger matching them to Revolut transactions"""
+    index_archive()
+    invoices = [invoice for invoice in load_invoices(date_from, date_to) if os.path.exists(invoice['path'])]
+    used = set()
+    counts = {'matched': 0, 'unmatched_transactions': 0, 'unmatched_invoices': 0, 'needs_review': 0}
+
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        # The ledger is streamed row by row straight into the archive
+        with bundle.open('ledger.csv', 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8', newline='') as ledger_file:
+            ledger = csv.DictWriter(ledger_file, fieldnames=LEDGER_FIELDS)
+            ledger.writeheader()
+
+            for transaction in read_transactions(transactions_path, date_from, date_to):
+                invoice = match_invoice(transaction, invoices, used)
+                if invoice:
+                    used.add(invoice['path'])
+                    counts['matched'] += 1
+                    ledger.writerow(ledger_row('matched', transaction, invoice))
+                else:
+                    counts['unmatched_transactions'] += 1
+                    ledger.writerow(ledger_row('unmatched_transaction', transaction, None))
+                    print(f"⚠️  No invoice for {transaction['date']} {transaction['description']} "
+                          f"{transaction['amount']:.2f} {transaction['currency']}")
+
+            # Invoices in the period that no transaction claimed
+            for invoice in invoices:
+                if invoice['path'] in used:
+                    continue
+                when = parse_date(invoice['invoice_date'])
+                if when is None or not date_from <= when <= date_to:
+                    continue
+                used.add(invoice['path'])
+                counts['unmatched_invoices'] += 1
+                ledger.writerow(ledger_row('unmatched_invoice', None, invoice))
+
+            # Invoices without a date can't be placed in a period, leave them to the accountant
+            for invoice in load_undated_invoices(date_from, date_to):
+                counts['needs_review'] += 1
+                ledger.writerow(ledger_row('needs_review', None, invoice))
+
+        # Files are copied from the archive in chunks, never loaded whole
+        for invoice in invoices:
+            if invoice['path'] in used:
+                add_file(bundle, invoice['path'], 'invoices')
+        for invoice in load_undated_invoices(date_from, date_to):
+            add_file(bundle, invoice['path'], 'review')
+
+        # Unmatched rows are listed in the streamed ledger (status column), only totals are kept here
+        bundle.writestr('summary.json', json.dumps({
+            'period': {'from': date_from.isoformat(), 'to': date_to.isoformat()},
+            'ledger': 'ledger.csv',
+            'counts': counts,
+        }, indent=2))
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a period's invoices and Revolut ledger for the accountant")
+    parser.add_argument('transactions', help="Revolut statement CSV export")
+    parser.add_argument('--from', dest='date_from', required=True, help="First day of the period (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', required=True, help="Last day of the period (YYYY-MM-DD)")
+    parser.add_argument('--output', help="ZIP file to write (default: export_<from>_<to>.zip)")
+    args = parser.parse_args()
+
+    date_from = datetime.strptime(args.date_from, "%Y-%m-%d").date()
+    date_to = datetime.strptime(args.date_to, "%Y-%m-%d").date()
+    output_path = args.output or f"export_{date_from:%Y%m%d}_{date_to:%Y%m%d}.zip"
+
+    counts = export_bundle(args.transactions, date_from, date_to, output_path)
+
+    print(f"📦 Export written: {output_path}")
+    print(f"✅ {counts['matched']} transaction(s) matched to invoices")
+    print(f"❌ {counts['unmatched_transactions']} transaction(s) without an invoice")
+    print(f"📄 {counts['unmatched_invoices']} invoice(s) without a transaction")
+    print(f"🔍 {counts['needs_review']} downloaded file(s) without an invoice date need review")
+
+
+if __name__ == "__main__":
+    main()
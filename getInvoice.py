@@ -1,10 +1,14 @@
 from langchain_openai import ChatOpenAI
 from browser_use import Agent, Controller, ActionResult, BrowserSession, BrowserProfile
 from dotenv import load_dotenv
+from pydantic import BaseModel
+import hashlib
 import os
+import random
 import requests
 from datetime import datetime
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
+from invoice_index import add_invoice, file_sha256, fill_missing_details, has_file_hash, index_archive, search_invoices
 load_dotenv()
 
 import asyncio
@@ -13,6 +17,52 @@ llm = ChatOpenAI(model="gpt-4o")
 
 controller = Controller()
 
+# Human-like headers used for every invoice file download
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+# Number of workers fetching invoice files at the same time in the batch download
+MAX_PARALLEL_DOWNLOADS = 4
+
+class InvoiceFile(BaseModel):
+    """An invoice file URL with the details shown next to it on the billing page"""
+    url: str
+    invoice_date: str | None = None  # YYYY-MM-DD
+    amount: float | None = None
+    currency: str | None = None
+
+# Vendor sites that need a deliberate, human-like pause after every agent step (clicks, typing, ...).
+# Maps the site's domain to a (min, max) jitter range in seconds, e.g. 'revolut.com': (0.3, 1.2).
+# Every other site gets no jitter.
+HUMANIZED_VENDORS: dict[str, tuple[float, float]] = {}
+
+# Longest automatic readiness wait after each agent step, in seconds
+STEP_READY_TIMEOUT = 5.0
+
+# Script resolving once the DOM has seen no mutations for `quiet_ms`, or after `timeout_ms`
+DOM_QUIET_SCRIPT = """
+([quietMs, timeoutMs]) => new Promise(resolve => {
+    let timer = setTimeout(done, quietMs);
+    const observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(done, quietMs);
+    });
+    const deadline = setTimeout(done, timeoutMs);
+    function done() {
+        observer.disconnect();
+        clearTimeout(timer);
+        clearTimeout(deadline);
+        resolve(true);
+    }
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+})
+"""
+
 @controller.action('Get login credentials')
 async def get_login_credentials(site_name: str, page) -> ActionResult:
     """Get email and password credentials from user for login"""
@@ -46,8 +96,111 @@ async def pause_for_human(instruction: str, page) -> ActionResult:
     print("▶️  Resuming agent...")
     return ActionResult(extracted_content="Human interaction completed, continuing with agent")
 
+async def wait_for_network_quiet(page, quiet: float, deadline: float) -> bool:
+    """Wait until no request has been in flight for `quiet` seconds, or the deadline passes"""
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+    last_activity = loop.time()
+
+    def started(request):
+        nonlocal last_activity
+        in_flight.add(request)
+        last_activity = loop.time()
+
+    def finished(request):
+        nonlocal last_activity
+        in_flight.discard(request)
+        last_activity = loop.time()
+
+    page.on('request', started)
+    page.on('requestfinished', finished)
+    page.on('requestfailed', finished)
+    try:
+        while loop.time() < deadline:
+            if not in_flight and loop.time() - last_activity >= quiet:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+    finally:
+        page.remove_listener('request', started)
+        page.remove_listener('requestfinished', finished)
+        page.remove_listener('requestfailed', finished)
+
+async def wait_until_ready(page, selector: str | None = None, wait_for_network: bool = True, wait_for_dom: bool = True, timeout: float = 10.0) -> list[str]:
+    """Run the readiness checks against one shared deadline and describe what was waited for"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    waited = []
+
+    def remaining_ms() -> int:
+        return max(int((deadline - loop.time()) * 1000), 1)
+
+    if selector:
+        await page.wait_for_selector(selector, state='visible', timeout=remaining_ms())
+        waited.append(f"selector '{selector}' visible")
+
+    if wait_for_network:
+        # Data fetched after load (e.g. a settings modal) counts, unlike the 'networkidle' load state
+        if await wait_for_network_quiet(page, 0.5, deadline):
+            waited.append("network idle")
+        else:
+            waited.append("network still busy at timeout")
+
+    if wait_for_dom and loop.time() < deadline:
+        await page.evaluate(DOM_QUIET_SCRIPT, [300, remaining_ms()])
+        waited.append("DOM settled")
+
+    return waited
+
+@controller.action('Wait for page to be ready')
+async def wait_for_page_ready(page, selector: str | None = None, wait_for_network: bool = True, wait_for_dom: bool = True, timeout: float = 10.0) -> ActionResult:
+    """Wait until the page is ready: target selector visible, network idle and DOM mutations settled"""
+    try:
+        waited = await wait_until_ready(page, selector=selector, wait_for_network=wait_for_network, wait_for_dom=wait_for_dom, timeout=timeout)
+        print(f"⏳ Page ready: {', '.join(waited) or 'nothing to wait for'}")
+        return ActionResult(extracted_content=f"Page ready ({', '.join(waited) or 'nothing to wait for'})")
+
+    except Exception as e:
+        print(f"❌ Page not ready: {e}")
+        return ActionResult(extracted_content=f"Page not ready within {timeout}s: {e}")
+
+@controller.action('Search invoice archive')
+async def search_invoice_archive(vendor_name: str | None = None, date_from: str | None = None, date_to: str | None = None, amount: float | None = None, text: str | None = None) -> ActionResult:
+    """Check which invoices are already saved, by vendor, invoice date range (YYYY-MM-DD), amount or text
+
+    Text search covers saved invoice content in full, but for PDFs and screenshots only their filename
+    and source URL, so search downloaded files by vendor, date and amount rather than invoice number.
+    """
+    try:
+        results = search_invoices(vendor_name=vendor_name, date_from=date_from, date_to=date_to, amount=amount, text=text, include_undated=True)
+    except Exception as e:
+        print(f"❌ Error searching invoice archive: {e}")
+        return ActionResult(extracted_content=f"Error searching invoice archive: {e}")
+
+    # Without an invoice date we can't tell which period a file covers, so it never counts as a match
+    dated = bool(date_from or date_to)
+    matches = [row for row in results if row['invoice_date'] or not dated]
+    undated = [row for row in results if not row['invoice_date'] and dated]
+
+    def describe(row) -> str:
+        details = [row['kind'], row['invoice_date'] or f"date unknown, saved {row['saved_at']}"]
+        if row['amount'] is not None:
+            details.append(f"{row['amount']:.2f} {row['currency'] or ''}".strip())
+        return f"{row['path']} ({', '.join(details)})"
+
+    if matches:
+        message = f"{len(matches)} matching invoice(s) already archived:\n" + "\n".join(describe(row) for row in matches)
+    else:
+        message = "No matching invoices in the archive"
+    if undated:
+        message += (f"\n{len(undated)} other archived file(s) have no invoice date and are not counted as matches, "
+                    f"they may or may not be the invoice you need:\n" + "\n".join(describe(row) for row in undated))
+
+    print(f"🔎 Found {len(matches)} archived invoice(s), {len(undated)} with unknown date")
+    return ActionResult(extracted_content=message)
+
 @controller.action('Download invoice file')
-async def download_invoice_file(vendor_name: str, file_url: str, page) -> ActionResult:
+async def download_invoice_file(vendor_name: str, file_url: str, page, invoice_date: str | None = None, amount: float | None = None, currency: str | None = None) -> ActionResult:
     """Download actual invoice file (PDF, image, etc.) from URL"""
     # Create invoices directory if it doesn't exist
     os.makedirs("invoices", exist_ok=True)
@@ -62,20 +215,25 @@ async def download_invoice_file(vendor_name: str, file_url: str, page) -> Action
         filename = f"invoices/{vendor_name.replace(' ', '_')}_{timestamp}{file_extension}"
         
         # Download the file with human-like headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-        }
-        response = requests.get(file_url, stream=True, headers=headers)
+        response = requests.get(file_url, stream=True, headers=DOWNLOAD_HEADERS)
         response.raise_for_status()
         
         with open(filename, 'wb') as f:
             for chunk in response.iter_content(chunk_size=8192):
                 f.write(chunk)
         
+        # Drop the new copy if the archive already holds this exact file
+        digest = file_sha256(filename)
+        existing = has_file_hash(digest)
+        if existing:
+            os.remove(filename)
+            # Backfilled or selector-downloaded copies start undated, keep what the agent knows now
+            fill_missing_details(existing, source_url=file_url, invoice_date=invoice_date, amount=amount, currency=currency)
+            print(f"⏭️  Invoice already archived: {existing}")
+            return ActionResult(extracted_content=f"Invoice already archived as {existing}, skipped download")
+        
+        add_invoice(filename, vendor_name, source_url=file_url, invoice_date=invoice_date, amount=amount, currency=currency, sha256=digest)
+        
         print(f"📄 Invoice file downloaded: {filename}")
         return ActionResult(extracted_content=f"Invoice file downloaded as {filename}")
         
@@ -83,8 +241,105 @@ async def download_invoice_file(vendor_name: str, file_url: str, page) -> Action
         print(f"❌ Error downloading invoice: {e}")
         return ActionResult(extracted_content=f"Error downloading invoice: {e}")
 
+@controller.action('Download all invoice files from billing page')
+async def download_invoice_files(vendor_name: str, page, files: list[InvoiceFile] | None = None, file_urls: list[str] | None = None, link_selector: str | None = None) -> ActionResult:
+    """Download many invoice files in one step, from files with their date/amount, plain URLs or every link matching a selector"""
+    # Create invoices directory if it doesn't exist
+    os.makedirs("invoices", exist_ok=True)
+
+    entries = list(files or []) + [InvoiceFile(url=url) for url in file_urls or []]
+
+    try:
+        # Collect links from the invoice column of the billing page
+        if link_selector:
+            for link in await page.query_selector_all(link_selector):
+                href = await link.get_attribute('href')
+                if href:
+                    entries.append(InvoiceFile(url=urljoin(page.url, href)))
+    except Exception as e:
+        print(f"❌ Error reading invoice links: {e}")
+        return ActionResult(extracted_content=f"Error reading invoice links: {e}")
+
+    if not entries:
+        return ActionResult(extracted_content="No invoice URLs given or found on the page")
+
+    # Reuse the browser's login cookies so portal-protected files can be fetched
+    try:
+        cookies = await page.context.cookies()
+    except Exception as e:
+        print(f"⚠️  Could not copy browser cookies: {e}")
+        cookies = []
+
+    saved, skipped, failed = [], [], []
+    seen_urls = set()
+    seen_hashes = {}  # digest -> file saved in this batch
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    queue = asyncio.Queue()
+
+    def fetch(session: requests.Session, url: str, filename: str) -> str:
+        """Stream a file to disk, hashing it while it is written"""
+        digest = hashlib.sha256()
+        with session.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(filename, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    async def worker():
+        # One session per worker, requests.Session isn't guaranteed to be thread-safe
+        with requests.Session() as session:
+            session.headers.update(DOWNLOAD_HEADERS)
+            for cookie in cookies:
+                session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+
+            while not queue.empty():
+                index, entry = queue.get_nowait()
+                url = entry.url
+                file_extension = os.path.splitext(urlparse(url).path)[1] or '.pdf'
+                filename = f"invoices/{vendor_name.replace(' ', '_')}_{timestamp}_{index:03d}{file_extension}"
+                try:
+                    digest = await asyncio.to_thread(fetch, session, url, filename)
+
+                    # Identical files served under different URLs, or already archived, are only kept once
+                    existing = seen_hashes.get(digest) or has_file_hash(digest)
+                    if existing:
+                        os.remove(filename)
+                        skipped.append(url)
+                        # Fill in only the details the kept copy doesn't have yet
+                        fill_missing_details(existing, source_url=url, invoice_date=entry.invoice_date, amount=entry.amount, currency=entry.currency)
+                        continue
+
+                    add_invoice(filename, vendor_name, source_url=url, invoice_date=entry.invoice_date, amount=entry.amount, currency=entry.currency, sha256=digest)
+                    seen_hashes[digest] = filename
+                    saved.append(filename)
+                except Exception as e:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    failed.append(f"{url} ({e})")
+
+    for entry in entries:
+        if entry.url in seen_urls:
+            skipped.append(entry.url)
+            continue
+        seen_urls.add(entry.url)
+        queue.put_nowait((len(seen_urls), entry))
+    await asyncio.gather(*(worker() for _ in range(MAX_PARALLEL_DOWNLOADS)))
+
+    summary = f"Batch download for {vendor_name}: {len(saved)} saved, {len(skipped)} skipped as duplicate, {len(failed)} failed"
+    if saved:
+        summary += "\nSaved: " + ", ".join(sorted(saved))
+    if skipped:
+        summary += "\nSkipped: " + ", ".join(skipped)
+    if failed:
+        summary += "\nFailed: " + ", ".join(failed)
+
+    print(f"📄 {summary}")
+    return ActionResult(extracted_content=summary)
+
 @controller.action('Save invoice content')
-async def save_invoice_content(vendor_name: str, invoice_content: str, page) -> ActionResult:
+async def save_invoice_content(vendor_name: str, invoice_content: str, page, invoice_date: str | None = None, amount: float | None = None, currency: str | None = None) -> ActionResult:
     """Save invoice text content to a local file"""
     # Create invoices directory if it doesn't exist
     os.makedirs("invoices", exist_ok=True)
@@ -101,6 +356,8 @@ async def save_invoice_content(vendor_name: str, invoice_content: str, page) ->
             f.write("="*50 + "\n\n")
             f.write(invoice_content)
         
+        add_invoice(filename, vendor_name, content=invoice_content, source_url=page.url, invoice_date=invoice_date, amount=amount, currency=currency)
+        
         print(f"💾 Invoice content saved: {filename}")
         return ActionResult(extracted_content=f"Invoice content saved as {filename}")
     except Exception as e:
@@ -108,7 +365,7 @@ async def save_invoice_content(vendor_name: str, invoice_content: str, page) ->
         return ActionResult(extracted_content=f"Error saving invoice content: {e}")
 
 @controller.action('Take screenshot of invoice')
-async def screenshot_invoice(vendor_name: str, page) -> ActionResult:
+async def screenshot_invoice(vendor_name: str, page, invoice_date: str | None = None, amount: float | None = None, currency: str | None = None) -> ActionResult:
     """Take a screenshot of the current invoice page"""
     # Create invoices directory if it doesn't exist
     os.makedirs("invoices", exist_ok=True)
@@ -121,6 +378,8 @@ async def screenshot_invoice(vendor_name: str, page) -> ActionResult:
         # Take screenshot
         await page.screenshot(path=filename, full_page=True)
         
+        add_invoice(filename, vendor_name, source_url=page.url, invoice_date=invoice_date, amount=amount, currency=currency)
+        
         print(f"📸 Invoice screenshot saved: {filename}")
         return ActionResult(extracted_content=f"Invoice screenshot saved as {filename}")
         
@@ -128,7 +387,33 @@ async def screenshot_invoice(vendor_name: str, page) -> ActionResult:
         print(f"❌ Error taking screenshot: {e}")
         return ActionResult(extracted_content=f"Error taking screenshot: {e}")
 
+def vendor_jitter(url: str) -> tuple[float, float] | None:
+    """Jitter range for the vendor site the browser is on, if it opted in"""
+    host = urlparse(url).hostname or ''
+    for domain, jitter in HUMANIZED_VENDORS.items():
+        if host == domain or host.endswith('.' + domain):
+            return jitter
+    return None
+
+async def settle_step(agent) -> None:
+    """After each agent step, wait for the page to be ready, then add the opt-in pause for HUMANIZED_VENDORS"""
+    page = await agent.browser_session.get_current_page()
+    try:
+        await wait_until_ready(page, timeout=STEP_READY_TIMEOUT)
+    except Exception:
+        # The page may navigate or close mid-check, the next step reads whatever is there
+        pass
+
+    jitter = vendor_jitter(page.url)
+    if jitter:
+        await asyncio.sleep(random.uniform(*jitter))
+
 async def main():
+    # Pick up artifacts saved before the index existed
+    indexed = index_archive()
+    if indexed:
+        print(f"🗂️  Indexed {indexed} existing invoice artifact(s)")
+    
     # Create a comprehensive stealth browser profile
     browser_profile = BrowserProfile(
         # Core stealth settings
@@ -156,9 +441,10 @@ async def main():
         bypass_csp=True,  # Bypass Content Security Policy
         ignore_https_errors=True,
         
-        # Behavioral settings to appear more human
-        slow_mo=100,  # Add slight delay between actions (100ms)
-        wait_between_actions=0.5,  # Wait 500ms between actions
+        # Readiness-based waiting instead of fixed delays
+        # (settle_step waits for readiness after every step, HUMANIZED_VENDORS adds opt-in jitter)
+        slow_mo=0,  # No fixed delay on every click and keystroke
+        wait_between_actions=0.0,  # No fixed pause between actions
         
         # Network settings
         extra_http_headers={
@@ -222,12 +508,16 @@ async def main():
         2. Use the 'Get login credentials' action to collect email and password from the user
         3. Fill in the login form with the provided credentials and log in
         4. Go to the account/billing section (usually found in user menu or settings)
+           (if the billing tab in the settings modal hasn't appeared yet, use wait_for_page_ready with a selector for it)
         5. Look for billing, invoices, or usage history sections
         6. Find and retrieve all available invoices
+           (use search_invoice_archive with vendor 'Notion' first and skip invoices already archived)
         7. Save invoices using the appropriate method:
-           * If it's a PDF or downloadable file, use download_invoice_file action with the file URL
+           * If there are several PDFs or downloadable files, use download_invoice_files action once, passing each file as files with its url, invoice date, amount and currency (or a selector for the invoice links when the details aren't shown)
+           * If it's a single PDF or downloadable file, use download_invoice_file action with the file URL
            * If it's visible content on the page, use save_invoice_content action with the text
            * If it's a complex invoice page, use screenshot_invoice action to capture the visual invoice
+           * Pass the invoice date (YYYY-MM-DD), amount and currency when saving so the archive can be searched later
         
         Priority: Always try to get the actual invoice file (PDF) first, then fall back to screenshots or text content.
         
@@ -238,7 +528,7 @@ async def main():
         llm=llm,
         browser_session=browser_session,
     )
-    result = await agent.run()
+    result = await agent.run(on_step_end=settle_step)
     print(result)
 
 asyncio.run(main()) 
\ No newline at end of file
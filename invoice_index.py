@@ -0,0 +1,202 @@
+import hashlib
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+INVOICES_DIR = "invoices"
+INDEX_PATH = os.path.join(INVOICES_DIR, "index.db")
+
+# Artifacts are saved as {vendor}_{YYYYmmdd}_{HHMMSS}[_suffix].ext
+FILENAME_PATTERN = re.compile(r"^(?P<vendor>.+?)_(?P<date>\d{8})_(?P<time>\d{6})(?P<rest>.*)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    path TEXT PRIMARY KEY,
+    vendor TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    saved_at TEXT NOT NULL,
+    invoice_date TEXT,
+    amount REAL,
+    currency TEXT,
+    source_url TEXT,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS invoices_vendor ON invoices (vendor);
+CREATE INDEX IF NOT EXISTS invoices_date ON invoices (invoice_date);
+CREATE INDEX IF NOT EXISTS invoices_sha256 ON invoices (sha256);
+CREATE VIRTUAL TABLE IF NOT EXISTS invoices_text USING fts5 (path UNINDEXED, vendor, content);
+"""
+
+
+def connect() -> sqlite3.Connection:
+    """Open the archive index, creating it if it doesn't exist"""
+    os.makedirs(INVOICES_DIR, exist_ok=True)
+    conn = sqlite3.connect(INDEX_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def normalize_vendor(vendor_name: str) -> str:
+    """Vendor key as used in artifact filenames"""
+    return vendor_name.strip().replace(' ', '_')
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file in chunks so large PDFs aren't read into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_kind(path: str) -> str:
+    """Classify an artifact by its filename"""
+    if path.endswith("_content.txt"):
+        return "content"
+    if path.endswith("_screenshot.png"):
+        return "screenshot"
+    return "file"
+
+
+def add_invoice(path: str, vendor_name: str, content: str | None = None, source_url: str | None = None,
+                invoice_date: str | None = None, amount: float | None = None, currency: str | None = None,
+                sha256: str | None = None) -> None:
+    """Record a newly written artifact in the index (replacing any previous entry for the same path)
+
+    Only text given as content is searchable, PDF and image text isn't extracted. Their filename and
+    source URL are indexed instead, which often carry the invoice number.
+    """
+    vendor = normalize_vendor(vendor_name)
+    # Prefer the timestamp baked into the filename, copied files keep their original save date
+    match = FILENAME_PATTERN.match(os.path.basename(path))
+    if match:
+        saved_at = datetime.strptime(match['date'] + match['time'], "%Y%m%d%H%M%S").isoformat()
+    else:
+        saved_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+    if sha256 is None:
+        sha256 = file_sha256(path)
+
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO invoices (path, vendor, kind, saved_at, invoice_date, amount, currency, source_url, sha256) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, vendor, artifact_kind(path), saved_at, invoice_date, amount, currency, source_url, sha256),
+        )
+        conn.execute("DELETE FROM invoices_text WHERE path = ?", (path,))
+        conn.execute(
+            "INSERT INTO invoices_text (path, vendor, content) VALUES (?, ?, ?)",
+            (path, vendor_name, content if content is not None else f"{os.path.basename(path)} {source_url or ''}"),
+        )
+
+
+def fill_missing_details(path: str, source_url: str | None = None, invoice_date: str | None = None,
+                         amount: float | None = None, currency: str | None = None) -> None:
+    """Add details to an indexed artifact, only where it has none recorded yet"""
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "UPDATE invoices SET source_url = COALESCE(source_url, ?), invoice_date = COALESCE(invoice_date, ?), "
+            "amount = COALESCE(amount, ?), currency = COALESCE(currency, ?) WHERE path = ?",
+            (source_url, invoice_date, amount, currency, path),
+        )
+
+
+def drop_missing(conn: sqlite3.Connection, paths: list[str]) -> None:
+    """Remove index rows for artifacts that were deleted from the invoices directory"""
+    with conn:
+        conn.executemany("DELETE FROM invoices WHERE path = ?", [(path,) for path in paths])
+        conn.executemany("DELETE FROM invoices_text WHERE path = ?", [(path,) for path in paths])
+
+
+def has_file_hash(sha256: str) -> str | None:
+    """Return the path of an archived file with this content hash, if it is still on disk"""
+    with closing(connect()) as conn:
+        paths = [row['path'] for row in conn.execute("SELECT path FROM invoices WHERE sha256 = ?", (sha256,))]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            drop_missing(conn, missing)
+    existing = [path for path in paths if path not in missing]
+    return existing[0] if existing else None
+
+
+def fts_query(text: str) -> str:
+    """Quote every word as an FTS5 string so invoice numbers like INV-001 or Q1/2026 aren't parsed as syntax"""
+    return " ".join('"' + token.replace('"', '""') + '"' for token in text.split())
+
+
+def search_invoices(vendor_name: str | None = None, date_from: str | None = None, date_to: str | None = None,
+                    amount: float | None = None, text: str | None = None, include_undated: bool = False,
+                    limit: int = 50) -> list[dict]:
+    """Search the archive by vendor, invoice date range (YYYY-MM-DD), amount and full text
+
+    Artifacts without a recorded invoice date never match a date range, their save date is only
+    the download date. With include_undated they are returned too, with invoice_date None.
+    """
+    query = "SELECT invoices.* FROM invoices"
+    conditions, params = [], []
+
+    if text and text.split():
+        query += " JOIN invoices_text ON invoices_text.path = invoices.path"
+        conditions.append("invoices_text MATCH ?")
+        params.append(fts_query(text))
+    if vendor_name:
+        conditions.append("invoices.vendor = ? COLLATE NOCASE")
+        params.append(normalize_vendor(vendor_name))
+    if date_from or date_to:
+        date_conditions = ["invoices.invoice_date IS NOT NULL"]
+        if date_from:
+            date_conditions.append("invoices.invoice_date >= ?")
+            params.append(date_from)
+        if date_to:
+            date_conditions.append("invoices.invoice_date <= ?")
+            params.append(date_to)
+        date_condition = " AND ".join(date_conditions)
+        if include_undated:
+            date_condition = f"(invoices.invoice_date IS NULL OR ({date_condition}))"
+        conditions.append(date_condition)
+    if amount is not None:
+        conditions.append("abs(invoices.amount - ?) < 0.005")
+        params.append(amount)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY COALESCE(invoices.invoice_date, invoices.saved_at) DESC LIMIT ?"
+    params.append(limit)
+
+    with closing(connect()) as conn:
+        rows = [dict(row) for row in conn.execute(query, params)]
+        # Files deleted since they were indexed are not in the archive anymore
+        missing = [row['path'] for row in rows if not os.path.exists(row['path'])]
+        if missing:
+            drop_missing(conn, missing)
+    return [row for row in rows if row['path'] not in missing]
+
+
+def index_archive() -> int:
+    """Add any artifacts already in the invoices directory that aren't indexed yet, and drop deleted ones"""
+    if not os.path.isdir(INVOICES_DIR):
+        return 0
+
+    with closing(connect()) as conn:
+        known = {row['path'] for row in conn.execute("SELECT path FROM invoices")}
+        drop_missing(conn, [path for path in known if not os.path.exists(path)])
+
+    added = 0
+    for name in sorted(os.listdir(INVOICES_DIR)):
+        path = f"{INVOICES_DIR}/{name}"
+        match = FILENAME_PATTERN.match(name)
+        if path in known or not match or not os.path.isfile(path):
+            continue
+
+        content = None
+        if artifact_kind(path) == "content":
+            with open(path, encoding='utf-8', errors='replace') as f:
+                content = f.read()
+
+        add_invoice(path, match['vendor'], content=content)
+        added += 1
+
+    return added